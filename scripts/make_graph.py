@@ -2,26 +2,30 @@ import pickle
 import pandas as pd
 import networkx as nx
 
+from src.utils import graph_to_csr, save_csr
+
 THRESHOLD = 20
 
 
 def make_bipartite_graph(data):
     """
     Create a bipartite graph from the interactions DataFrame.
-    Users are assigned bipartite=0 and books bipartite=1.
+    Users are assigned bipartite="users" and books bipartite="books",
+    the labels the recommenders expect, so no relabeling pass is needed
+    when the graph is loaded back.
     """
     B = nx.Graph()
-    # Add user nodes (partition 0)
+    # Add user nodes
     users = data["user_id"].unique()
-    B.add_nodes_from(users, bipartite=0)
+    B.add_nodes_from(users, bipartite="users")
 
-    # Add book nodes (partition 1)
+    # Add book nodes
     books = data["book_id"].unique()
-    B.add_nodes_from(books, bipartite=1)
+    B.add_nodes_from(books, bipartite="books")
 
-    # Add edges between users and books
-    for _, row in data.iterrows():
-        B.add_edge(row["user_id"], row["book_id"])
+    # Add edges between users and books; zipping the numpy columns avoids
+    # the per-row overhead of iterrows
+    B.add_edges_from(zip(data["user_id"].to_numpy(), data["book_id"].to_numpy()))
 
     return B
 
@@ -67,6 +71,13 @@ def main():
         pickle.dump(subgraph, f)
     print("Largest connected bipartite component saved to data/bipartite_graph.gpickle")
 
+    # Save the flat CSR representation used by the recommenders
+    user_nodes = [n for n, d in subgraph.nodes(data=True) if d["bipartite"] == "users"]
+    book_nodes = [n for n, d in subgraph.nodes(data=True) if d["bipartite"] == "books"]
+    M = graph_to_csr(subgraph, user_nodes, book_nodes)
+    save_csr("data/bipartite_graph.npz", M, user_nodes, book_nodes)
+    print("Incidence matrix saved to data/bipartite_graph.npz")
+
     B_df = nx.to_pandas_edgelist(B, source="users", target="books")
     B_df.to_pickle("data/bipartite_graph_df.pkl")
     print("Edgelist dataframe saved to data/bipartite_graph_df.pkl")
@@ -1,97 +1,19 @@
-import math
-import heapq
 from typing import List, Tuple, Optional
 
 import networkx as nx
+import numpy as np
 
-from src.utils import get_users_for_book, get_books_for_user
-
-
-def jaccard_similarity(users_b1: set, users_b2: set) -> float:
-    """Compute Jaccard similarity between two books based on common users.
-
-    Args:
-        users_b1 (set): Users who read the first book.
-        users_b2 (set): Users who read the second book.
-
-    Returns:
-        float: Jaccard similarity score.
-    """
-    if not users_b1 and not users_b2:
-        return 0.0
-    intersection = users_b1 & users_b2
-    union = users_b1 | users_b2
-    return len(intersection) / len(union)
-
-
-def overlap_coefficient(users_b1: set, users_b2: set) -> float:
-    """
-    Compute overlap coefficient between two books based on common users.
-
-    Args:
-        users_b1 (set): Users who read the first book.
-        users_b2 (set): Users who read the second book.
-
-    Returns:
-        float: Overlap coefficient score.
-    """
-    if not users_b1 or not users_b2:
-        return 0.0
-    intersection = users_b1 & users_b2
-    min_size = min(len(users_b1), len(users_b2))
-    return len(intersection) / min_size
-
-
-def adamic_adar_similarity(users_b1: set, users_b2: set, books_cache: dict) -> float:
-    """
-    Compute Adamic-Adar similarity between two books based on common users.
-
-    Args:
-        users_b1 (set): Users who read the first book.
-        users_b2 (set): Users who read the second book.
-        books_cache (dict): Cache of books read by users.
-
-    Returns:
-        float: Adamic-Adar similarity score.
-    """
-    common_users = users_b1 & users_b2
-    if not common_users:
-        return 0.0
-    aa_sum = 0.0
-    for user in common_users:
-        degree = len(books_cache[user])
-        if degree > 1:
-            aa_sum += 1.0 / math.log(degree)
-    return aa_sum
-
-
-def resource_allocation_similarity(
-    users_b1: set, users_b2: set, books_cache: dict
-) -> float:
-    """
-    Compute Resource Allocation similarity between two books based on common users.
-
-    Args:
-        users_b1 (set): Users who read the first book.
-        users_b2 (set): Users who read the second book.
-        books_cache (dict): Cache of books read by users.
-
-    Returns:
-        float: Resource Allocation similarity score.
-    """
-    common_users = users_b1 & users_b2
-    if not common_users:
-        return 0.0
-    ra_sum = 0.0
-    for user in common_users:
-        degree = len(books_cache[user])
-        if degree > 0:
-            ra_sum += 1.0 / degree
-    return ra_sum
+from src.utils import cached_neighborhoods
 
 
 def get_recommendations_cf(
-    G: nx.Graph, target_user: str, method: str = "jaccard", top_n: int = 5
+    G: nx.Graph,
+    target_user: str,
+    method: str = "jaccard",
+    top_n: int = 5,
+    caches: Optional[dict] = None,
+    excluded_books: Optional[set] = None,
+    candidate_prune_k: Optional[int] = 500,
 ) -> List[Tuple[str, float]]:
     """
     Get book recommendations for a user based on collaborative filtering.
@@ -101,6 +23,14 @@ def get_recommendations_cf(
         target_user (str): The user node for whom to get recommendations.
         method (str, optional): Similarity method to use. Defaults to "jaccard".
         top_n (int, optional): Number of recommendations to return. Defaults to 5.
+        caches (dict, optional): Precomputed neighborhood caches, as returned
+            by ``precompute_neighborhoods``. Computed from G if not given.
+        excluded_books (set, optional): Books to treat as unread for this
+            call, so evaluation can hold out edges without mutating the graph.
+        candidate_prune_k (int, optional): Score only the candidates with the
+            most co-readers when there are more than this many; most share
+            just one or two co-readers and cannot rank high. None disables
+            pruning. Defaults to 500.
 
     Raises:
         ValueError: If the similarity method is unknown.
@@ -108,61 +38,94 @@ def get_recommendations_cf(
     Returns:
         List[Tuple[str, float]]: A list of recommended books and their scores.
     """
-    read_books = {
-        n for n in G.neighbors(target_user) if G.nodes[n]["bipartite"] == "books"
-    }
-
-    # Precompute users for each book and books for each user
-    users_cache = {}
-    books_cache = {}
-    for node, data in G.nodes(data=True):
-        if data["bipartite"] == "books":
-            users_cache[node] = get_users_for_book(G, node)
-        elif data["bipartite"] == "users":
-            books_cache[node] = get_books_for_user(G, node)
-
-    if method == "jaccard":
-        similarity_func = lambda b1, b2: jaccard_similarity(
-            users_cache[b1], users_cache[b2]
-        )
-    elif method == "overlap":
-        similarity_func = lambda b1, b2: overlap_coefficient(
-            users_cache[b1], users_cache[b2]
-        )
-    elif method == "adamic_adar":
-        similarity_func = lambda b1, b2: adamic_adar_similarity(
-            users_cache[b1], users_cache[b2], books_cache
-        )
-    elif method == "resource_allocation":
-        similarity_func = lambda b1, b2: resource_allocation_similarity(
-            users_cache[b1], users_cache[b2], books_cache
-        )
-    else:
+    # Neighborhood caches are graph-wide; reuse them across calls
+    if caches is None:
+        caches = cached_neighborhoods(G)
+    books_cache = caches["books_cache"]
+    M = caches["M"]
+    book_index = caches["book_index"]
+    book_ids = caches["book_ids"]
+
+    read_books = set(books_cache[target_user])
+    held_books = set()
+    if excluded_books:
+        held_books = read_books & excluded_books
+        read_books -= excluded_books
+
+    if method not in ("jaccard", "overlap", "adamic_adar", "resource_allocation"):
         raise ValueError(
             "Unknown similarity method. Allowed: 'jaccard', 'overlap', 'adamic_adar', 'resource_allocation'"
         )
 
-    candidate_scores = {}
-
-    # Collect all candidate books via co-readers (excluding already read)
-    candidate_books = set()
-    for b in read_books:
-        users = users_cache[b] - {target_user}
-        for u in users:
-            candidate_books.update(books_cache[u])
-    candidate_books -= read_books
-
-    # Compute similarity scores only for candidate books
-    for candidate in candidate_books:
-        score = 0.0
-        for b in read_books:
-            sim = similarity_func(b, candidate)
-            score += sim
-        if score > 0:
-            candidate_scores[candidate] = score
-
-    # Efficient top-N selection
-    recommendations = heapq.nlargest(
-        top_n, candidate_scores.items(), key=lambda x: x[1]
+    if not read_books:
+        return []
+
+    read = np.fromiter(
+        (book_index[b] for b in read_books), dtype=np.int64, count=len(read_books)
     )
-    return recommendations
+
+    # Candidates are the books of the target's co-readers: count each
+    # user's shared read books, then fan the counts back out over the
+    # books they read - two sparse matvecs instead of millions of
+    # set.update calls
+    co_readers = np.asarray(M[:, read].sum(axis=1)).ravel()
+    co_readers[caches["user_index"][target_user]] = 0.0
+    co_count = M.T @ co_readers
+    co_count[read] = 0.0
+    cand = np.nonzero(co_count)[0]
+
+    if not cand.size:
+        return []
+
+    # Keep only the candidates with the most co-readers; the counts
+    # bound the similarity before the full scoring product
+    if candidate_prune_k is not None and cand.size > candidate_prune_k:
+        keep = np.argpartition(-co_count[cand], candidate_prune_k)[:candidate_prune_k]
+        cand = cand[keep]
+
+    candidates = [book_ids[i] for i in cand]
+
+    # The matrix rows still contain the held-out edges, so the target's
+    # own reading leaks into every held-out candidate's co-reader counts;
+    # subtract the target's contribution from those rows
+    target_idx = caches["user_index"][target_user]
+    held = np.isin(cand, [book_index[b] for b in held_books])
+
+    # Score all candidate/read pairs with one sparse matrix product:
+    # co[i, j] holds the (weighted) co-reader count of candidate i and read book j
+    if method == "adamic_adar":
+        co = (M[:, cand].T @ caches["M_aa"][:, read]).toarray()
+        co[held] -= caches["log_inv_deg"][target_idx]
+        sim = co
+    elif method == "resource_allocation":
+        co = (M[:, cand].T @ caches["M_ra"][:, read]).toarray()
+        co[held] -= caches["inv_deg"][target_idx]
+        sim = co
+    else:
+        # Count on the hub-capped matrix: very-high-degree users co-occur
+        # with nearly everything and would swamp the plain counts
+        M_cap = caches["M_cap"]
+        deg_b_cap = caches["deg_b_cap"]
+        co = (M_cap[:, cand].T @ M_cap[:, read]).toarray()
+        # A hub-capped target contributes nothing to the counts
+        target_active = M_cap.indptr[target_idx + 1] > M_cap.indptr[target_idx]
+        w = np.float32(1.0) if target_active else np.float32(0.0)
+        co[held] -= w
+        deg_cand = deg_b_cap[cand].copy()
+        deg_cand[held] -= w
+        if method == "jaccard":
+            denom = deg_cand[:, None] + deg_b_cap[read][None, :] - co
+        else:
+            denom = np.minimum(deg_cand[:, None], deg_b_cap[read][None, :])
+        # float32 literal so the similarity table never promotes to float64
+        sim = np.where(denom > 0, co / denom, np.float32(0.0))
+
+    scores = sim.sum(axis=1)
+
+    # Top-N selection: partial partition, then sort only the kept k
+    if top_n < scores.size:
+        idx = np.argpartition(-scores, top_n)[:top_n]
+    else:
+        idx = np.arange(scores.size)
+    idx = idx[np.argsort(-scores[idx])]
+    return [(candidates[i], float(scores[i])) for i in idx if scores[i] > 0]
@@ -1,5 +1,8 @@
+import functools
+import os
 import random
 import time
+from multiprocessing import Pool
 
 import pandas as pd
 
@@ -7,44 +10,129 @@ from src.collaborative_filtering import get_recommendations_cf
 from src.personalized_pagerank import get_recommendations_ppr
 from src.utils import get_books_for_user
 
+# Per-worker state, set once by _init_worker instead of pickled per task
+_worker_state = {}
 
-def get_recommendations_func(method):
+
+def get_recommendations_func(method, caches=None):
     if method == "pagerank":
         return get_recommendations_ppr
     else:
-        return lambda G, target_user, top_n: get_recommendations_cf(
-            G=G, target_user=target_user, top_n=top_n, method=method
+        return functools.partial(get_recommendations_cf, method=method, caches=caches)
+
+
+def make_excluded_by_user(graph, test_users, test_size=0.2, book_set=None):
+    """Sample the held-out books for every test user up front."""
+    excluded_by_user = {}
+    for test_user in test_users:
+        test_books = get_books_for_user(graph, test_user, book_set)
+        excluded_by_user[test_user] = set(
+            random.sample(sorted(test_books), k=int(len(test_books) * test_size))
         )
+    return excluded_by_user
 
 
-def get_metrics_for_user(graph, test_user, get_recommendations, k, test_size):
-    test_books = get_books_for_user(graph, test_user)
-    random_sample = random.sample(
-        sorted(test_books), k=int(len(test_books) * test_size)
-    )
-    for book in random_sample:
-        graph.remove_edge(test_user, book)
+def metrics_from_recommendations(
+    graph, recommendations_by_user, excluded_by_user, k, execution_time=0.0, book_set=None
+):
+    """Compute the per-user metric rows for precomputed recommendations."""
+    log = []
+    for test_user, recommendations in recommendations_by_user.items():
+        test_books = get_books_for_user(graph, test_user, book_set)
+        recommended_books = set([r[0] for r in recommendations])
+        log.append(
+            {
+                "user": test_user,
+                "precision": len(recommended_books.intersection(set(test_books))) / k,
+                "recall": len(recommended_books.intersection(set(test_books)))
+                / len(excluded_by_user[test_user]),
+                "execution_time": execution_time,
+            }
+        )
+    return pd.DataFrame(log)
+
+
+def get_metrics_for_user(
+    graph, test_user, get_recommendations, k, test_size, excluded_books=None, book_set=None
+):
+    test_books = get_books_for_user(graph, test_user, book_set)
+    if excluded_books is None:
+        excluded_books = set(
+            random.sample(sorted(test_books), k=int(len(test_books) * test_size))
+        )
     start = time.time()
-    recommendations = get_recommendations(graph, test_user, top_n=k)
+    recommendations = get_recommendations(
+        graph, test_user, top_n=k, excluded_books=excluded_books
+    )
     execution_time = time.time() - start
     recommended_books = set([r[0] for r in recommendations])
-    for book in recommended_books:
-        graph.add_edge(test_user, book)
     return {
         "user": test_user,
         "precision": len(recommended_books.intersection(set(test_books))) / k,
         "recall": len(recommended_books.intersection(set(test_books)))
-        / len(random_sample),
+        / len(excluded_books),
         "execution_time": execution_time,
     }
 
 
-def get_metrics_at_k(graph, test_users, get_recommendations, k=15, test_size=0.2):
-    log = []
-    for user in test_users:
-        log.append(
+def _init_worker(graph, get_recommendations, k, test_size, book_set):
+    _worker_state["graph"] = graph
+    _worker_state["get_recommendations"] = get_recommendations
+    _worker_state["k"] = k
+    _worker_state["test_size"] = test_size
+    _worker_state["book_set"] = book_set
+
+
+def _run_user(test_user, excluded_books):
+    return get_metrics_for_user(
+        _worker_state["graph"],
+        test_user,
+        _worker_state["get_recommendations"],
+        k=_worker_state["k"],
+        test_size=_worker_state["test_size"],
+        excluded_books=excluded_books,
+        book_set=_worker_state["book_set"],
+    )
+
+
+def get_metrics_at_k(
+    graph,
+    test_users,
+    get_recommendations,
+    k=15,
+    test_size=0.2,
+    processes=None,
+    excluded_by_user=None,
+    book_set=None,
+):
+    # Sample the held-out books in the parent so the evaluation does not
+    # depend on worker scheduling or per-process random state
+    if excluded_by_user is None:
+        excluded_by_user = make_excluded_by_user(graph, test_users, test_size, book_set)
+    if processes is None:
+        processes = os.cpu_count()
+    if processes == 1:
+        log = [
             get_metrics_for_user(
-                graph, user, get_recommendations, k=k, test_size=test_size
+                graph,
+                user,
+                get_recommendations,
+                k=k,
+                test_size=test_size,
+                excluded_books=excluded_by_user[user],
+                book_set=book_set,
+            )
+            for user in test_users
+        ]
+    else:
+        # Users are independent now that the graph is never mutated, so
+        # fan them out across processes
+        with Pool(
+            processes=processes,
+            initializer=_init_worker,
+            initargs=(graph, get_recommendations, k, test_size, book_set),
+        ) as pool:
+            log = pool.starmap(
+                _run_user, [(user, excluded_by_user[user]) for user in test_users]
             )
-        )
     return pd.DataFrame(log)
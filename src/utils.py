@@ -1,8 +1,11 @@
+import functools
 import random
 import pickle
 from typing import Optional
 
 import networkx as nx
+import numpy as np
+import scipy.sparse as sp
 
 
 def create_random_bipartite_graph(
@@ -36,52 +39,256 @@ def create_random_bipartite_graph(
     return G
 
 
-def create_bipartite_from_pkl(pkl_path: str, users_key: int = 0, books_key: int = 1):
-    """Create a bipartite graph from a pickle file.
+def create_bipartite_from_pkl(
+    pkl_path: str, users_key: str = "users", books_key: str = "books"
+):
+    """Load a bipartite graph from a pickle file.
+
+    The graph is pickled with its final "users"/"books" labels by
+    make_graph, so no node or edge needs to be copied - only the partition
+    frozensets are collected from the node attributes.
 
     Args:
         pkl_path (str): Path to the pickle file containing the graph.
-        users_key (int, optional): Key for user nodes in the pickled graph. Defaults to 0.
-        books_key (int, optional): Key for book nodes in the pickled graph. Defaults to 1.
+        users_key (str, optional): Partition label of user nodes. Defaults to "users".
+        books_key (str, optional): Partition label of book nodes. Defaults to "books".
 
     Returns:
-        _type_: _description_
+        tuple: ``(G, user_nodes, book_nodes)`` - the unpickled graph plus
+        frozensets of its user and book nodes, so callers can filter
+        neighborhoods with set intersections instead of attribute lookups.
     """
 
     with open(pkl_path, "rb") as f:
         G = pickle.load(f)
 
-    user_nodes = [n for n, data in G.nodes(data=True) if data["bipartite"] == users_key]
-    book_nodes = [n for n, data in G.nodes(data=True) if data["bipartite"] == books_key]
-    B = nx.Graph()
-    B.add_nodes_from(user_nodes, bipartite="users")
-    B.add_nodes_from(book_nodes, bipartite="books")
-    B.add_edges_from(G.edges())
+    user_nodes = frozenset(
+        n for n, data in G.nodes(data=True) if data["bipartite"] == users_key
+    )
+    book_nodes = frozenset(
+        n for n, data in G.nodes(data=True) if data["bipartite"] == books_key
+    )
+    return G, user_nodes, book_nodes
+
+
+def graph_to_csr(G: nx.Graph, user_nodes: list, book_nodes: list) -> sp.csr_matrix:
+    """Build the user x book incidence CSR matrix of a bipartite graph.
+
+    Args:
+        G (nx.Graph): The bipartite graph.
+        user_nodes (list): User nodes; list position becomes the row index.
+        book_nodes (list): Book nodes; list position becomes the column index.
+
+    Returns:
+        sp.csr_matrix: float32 matrix with M[u, b] = 1 if user u read book b.
+    """
+    user_index = {user: i for i, user in enumerate(user_nodes)}
+    rows = []
+    cols = []
+    for j, book in enumerate(book_nodes):
+        for user in G.adj[book]:
+            rows.append(user_index[user])
+            cols.append(j)
+    return sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(len(user_nodes), len(book_nodes)),
+    )
+
+
+def save_csr(path: str, M: sp.csr_matrix, users: list, books: list) -> None:
+    """Save the incidence matrix and its id mappings to a .npz file.
+
+    Args:
+        path (str): Destination .npz path.
+        M (sp.csr_matrix): User x book incidence matrix.
+        users (list): User node names, position = row index.
+        books (list): Book node names, position = column index.
+    """
+    np.savez_compressed(
+        path,
+        data=M.data,
+        indices=M.indices,
+        indptr=M.indptr,
+        shape=np.asarray(M.shape),
+        users=np.asarray(users),
+        books=np.asarray(books),
+    )
+
+
+def load_csr(path: str) -> tuple:
+    """Load the incidence matrix saved by :func:`save_csr`.
+
+    Args:
+        path (str): Path to the .npz file.
+
+    Returns:
+        tuple: ``(M, users, books)`` - the CSR matrix and the user/book node
+        names per row/column index.
+    """
+    with np.load(path) as z:
+        M = sp.csr_matrix(
+            (z["data"], z["indices"], z["indptr"]), shape=tuple(z["shape"])
+        )
+        users = list(z["users"])
+        books = list(z["books"])
+    return M, users, books
+
+
+def caches_from_csr(
+    M: sp.csr_matrix,
+    users: list,
+    books: list,
+    hub_user_quantile: Optional[float] = 0.99,
+) -> dict:
+    """Build the recommendation caches from the incidence CSR matrix.
+
+    Everything the collaborative filtering path needs is derived from flat
+    CSR/CSC index arrays, so no NetworkX adjacency dicts are touched. Users
+    are interned to contiguous integer indices and the matrix itself (plus
+    degree-weighted variants) drives the bulk scoring.
 
-    return B
+    Args:
+        M (sp.csr_matrix): User x book incidence matrix.
+        users (list): User node names, position = row index.
+        books (list): Book node names, position = column index.
+        hub_user_quantile (float, optional): Degree quantile above which
+            users are dropped from the count-based (Jaccard/overlap)
+            matrix. Hub users co-occur with almost everything, so they
+            dominate intersection cost while carrying little signal; the
+            1/log(degree) weighting already handles them for AA/RA. None
+            disables the cap. Defaults to 0.99.
+
+    Returns:
+        dict: Cache dictionary with keys:
+            - ``books_cache``: user -> set of books they read.
+            - ``user_index``: user -> contiguous row index.
+            - ``book_index``: book -> contiguous column index.
+            - ``book_ids``: list of book nodes, position = column index.
+            - ``inv_deg``: float32 array of 1/degree per user index.
+            - ``log_inv_deg``: float32 array of 1/log(degree) per user index.
+            - ``M``: float32 CSR matrix, M[u, b] = 1 if user u read book b.
+            - ``M_aa``, ``M_ra``: M with rows weighted by ``log_inv_deg`` /
+              ``inv_deg``, for Adamic-Adar and Resource Allocation.
+            - ``M_cap``, ``deg_b_cap``: M with hub-user rows zeroed out and
+              the matching book degrees, for Jaccard/overlap counting.
+            - ``deg_b``: float32 array of book degrees per column index.
+    """
+    users = list(users)
+    books = list(books)
+    M = M.tocsr().astype(np.float32)
+
+    user_index = {user: i for i, user in enumerate(users)}
+    book_index = {book: j for j, book in enumerate(books)}
+
+    books_cache = {
+        user: {books[j] for j in M.indices[M.indptr[i] : M.indptr[i + 1]]}
+        for i, user in enumerate(users)
+    }
+
+    # Per-user degree weights for Adamic-Adar / Resource Allocation
+    deg = np.asarray(M.sum(axis=1), dtype=np.float64).ravel()
+    with np.errstate(divide="ignore"):
+        inv_deg = np.where(deg > 0, 1.0 / deg, 0.0).astype(np.float32)
+        log_inv_deg = np.where(deg > 1, 1.0 / np.log(deg), 0.0).astype(np.float32)
+
+    M_aa = sp.diags(log_inv_deg) @ M
+    M_ra = sp.diags(inv_deg) @ M
+    deg_b = np.asarray(M.sum(axis=0), dtype=np.float32).ravel()
+
+    # Drop hub users from the count-based similarity matrix
+    if hub_user_quantile is not None:
+        d_max = np.quantile(deg, hub_user_quantile)
+        active_user_mask = (deg <= d_max).astype(np.float32)
+        if active_user_mask.all():
+            M_cap = M
+        else:
+            M_cap = (sp.diags(active_user_mask) @ M).tocsr()
+    else:
+        M_cap = M
+    deg_b_cap = np.asarray(M_cap.sum(axis=0), dtype=np.float32).ravel()
+
+    return {
+        "books_cache": books_cache,
+        "user_index": user_index,
+        "book_index": book_index,
+        "book_ids": books,
+        "inv_deg": inv_deg,
+        "log_inv_deg": log_inv_deg,
+        "M": M,
+        "M_aa": M_aa,
+        "M_ra": M_ra,
+        "M_cap": M_cap,
+        "deg_b_cap": deg_b_cap,
+        "deg_b": deg_b,
+    }
+
+
+def precompute_neighborhoods(G: nx.Graph) -> dict:
+    """Precompute the recommendation caches for a bipartite graph.
+
+    Partitions the nodes by their ``bipartite`` attribute, builds the user x
+    book incidence CSR matrix, and derives every cache from it; see
+    :func:`caches_from_csr` for the returned keys. Doing this once per graph
+    avoids rebuilding the same caches for every recommendation call.
+
+    Args:
+        G (nx.Graph): The bipartite graph.
+
+    Returns:
+        dict: Cache dictionary as returned by :func:`caches_from_csr`.
+    """
+    user_nodes = []
+    book_nodes = []
+    for node, data in G.nodes(data=True):
+        if data["bipartite"] == "users":
+            user_nodes.append(node)
+        else:
+            book_nodes.append(node)
+    M = graph_to_csr(G, user_nodes, book_nodes)
+    return caches_from_csr(M, user_nodes, book_nodes)
+
+
+@functools.lru_cache(maxsize=4)
+def cached_neighborhoods(G: nx.Graph) -> dict:
+    """Memoized :func:`precompute_neighborhoods` keyed on graph identity.
+
+    Fallback for callers that do not thread the caches through themselves;
+    ``nx.Graph`` hashes by identity, so this is effectively keyed on ``id(G)``.
+    """
+    return precompute_neighborhoods(G)
 
 
-def get_users_for_book(G: nx.Graph, book: str) -> set:
+def get_users_for_book(G: nx.Graph, book: str, user_set: Optional[frozenset] = None) -> set:
     """Get users who have read a specific book.
 
     Args:
         G (nx.Graph): The bipartite graph.
         book (str): The book node.
+        user_set (frozenset, optional): Precomputed set of all user nodes.
+            When given, the neighbors are filtered with a C-level set
+            intersection instead of a per-neighbor attribute lookup.
 
     Returns:
         set: A set of user nodes who have read the book.
     """
+    if user_set is not None:
+        return G.adj[book].keys() & user_set
     return {n for n in G.neighbors(book) if G.nodes[n]["bipartite"] == "users"}
 
 
-def get_books_for_user(G: nx.Graph, user: str) -> set:
+def get_books_for_user(G: nx.Graph, user: str, book_set: Optional[frozenset] = None) -> set:
     """Get books read by a specific user.
 
     Args:
         G (nx.Graph): The bipartite graph.
         user (str): The user node.
+        book_set (frozenset, optional): Precomputed set of all book nodes.
+            When given, the neighbors are filtered with a C-level set
+            intersection instead of a per-neighbor attribute lookup.
 
     Returns:
         set: A set of book nodes read by the user.
     """
+    if book_set is not None:
+        return G.adj[user].keys() & book_set
     return {n for n in G.neighbors(user) if G.nodes[n]["bipartite"] == "books"}